@@ -0,0 +1,210 @@
+/*
+ * Vectorised single precision exponential function (and the activation
+ * functions based on it) for the ml.nn module.
+ *
+ * exp(x) is computed as 2^n * exp(r) with n = round(x / ln(2)) and the
+ * remainder r = x - n * ln(2), which is obtained by Cody-Waite range
+ * reduction (i.e. ln(2) is split into a high and a low part). exp(r) is
+ * approximated by a polynomial (Cephes coefficients) and scaled by 2^n via
+ * the exponent bits; 2^n is applied in two factors to handle (subnormal)
+ * results close to the range limits. The relative error is below 2 ulp.
+ *
+ * exp(x) - 1 (needed by the ELU) suffers from cancellation for small |x|,
+ * thus expm1(x) is approximated by its Taylor polynomial for |x| <= 0.5
+ * (truncation error below 1.5e-8 relative) and computed as exp(x) - 1
+ * elsewhere; the error of expm1(x) stays within about 2 ulp.
+ *
+ * The AVX2/FMA version is chosen at runtime if supported by the CPU,
+ * otherwise expf()/expm1f() of the C library is used.
+ */
+
+#include <math.h>
+#include <string.h>
+
+#include "_vec_exp.h"
+
+#if (defined(__GNUC__) || defined(__clang__)) && \
+    (defined(__x86_64__) || defined(__i386__))
+#define HAVE_AVX2_KERNEL 1
+#include <immintrin.h>
+#endif
+
+#ifdef HAVE_AVX2_KERNEL
+
+/* inputs above/below these values yield inf/0 */
+#define EXP_HI 88.72283935546875f
+#define EXP_LO -103.97208404541015625f
+
+#define LOG2E 1.44269504088896341f
+/* ln(2) split into a high part (exactly representable) and a low part */
+#define LN2_HI 0.693359375f
+#define LN2_LO -2.12194440e-4f
+
+#define C0 1.9875691500e-4f
+#define C1 1.3981999507e-3f
+#define C2 8.3334519073e-3f
+#define C3 4.1665795894e-2f
+#define C4 1.6666665459e-1f
+#define C5 5.0000001201e-1f
+
+__attribute__((target("avx2,fma")))
+static inline __m256 exp256_ps(__m256 x)
+{
+    __m256 n, r, r2, p, y;
+    __m256i ni, n1, n2;
+    /* range reduction */
+    n = _mm256_round_ps(_mm256_mul_ps(x, _mm256_set1_ps(LOG2E)),
+                        _MM_FROUND_TO_NEAREST_INT | _MM_FROUND_NO_EXC);
+    r = _mm256_fnmadd_ps(n, _mm256_set1_ps(LN2_HI), x);
+    r = _mm256_fnmadd_ps(n, _mm256_set1_ps(LN2_LO), r);
+    /* polynomial approximation of exp(r) */
+    r2 = _mm256_mul_ps(r, r);
+    p = _mm256_set1_ps(C0);
+    p = _mm256_fmadd_ps(p, r, _mm256_set1_ps(C1));
+    p = _mm256_fmadd_ps(p, r, _mm256_set1_ps(C2));
+    p = _mm256_fmadd_ps(p, r, _mm256_set1_ps(C3));
+    p = _mm256_fmadd_ps(p, r, _mm256_set1_ps(C4));
+    p = _mm256_fmadd_ps(p, r, _mm256_set1_ps(C5));
+    p = _mm256_fmadd_ps(p, r2, _mm256_add_ps(r, _mm256_set1_ps(1.f)));
+    /* scale by 2^n = 2^n1 * 2^n2 */
+    ni = _mm256_cvtps_epi32(n);
+    n1 = _mm256_srai_epi32(ni, 1);
+    n2 = _mm256_sub_epi32(ni, n1);
+    n1 = _mm256_slli_epi32(_mm256_add_epi32(n1, _mm256_set1_epi32(127)), 23);
+    n2 = _mm256_slli_epi32(_mm256_add_epi32(n2, _mm256_set1_epi32(127)), 23);
+    y = _mm256_mul_ps(_mm256_mul_ps(p, _mm256_castsi256_ps(n1)),
+                      _mm256_castsi256_ps(n2));
+    /* overflow, underflow and NaN */
+    y = _mm256_blendv_ps(y, _mm256_set1_ps(INFINITY),
+                         _mm256_cmp_ps(x, _mm256_set1_ps(EXP_HI), _CMP_GT_OQ));
+    y = _mm256_blendv_ps(y, _mm256_setzero_ps(),
+                         _mm256_cmp_ps(x, _mm256_set1_ps(EXP_LO), _CMP_LT_OQ));
+    return _mm256_blendv_ps(y, x, _mm256_cmp_ps(x, x, _CMP_UNORD_Q));
+}
+
+/* Taylor coefficients of expm1(x), 1 / k! for k = 8 ... 2 */
+#define E8 2.4801587301587302e-5f
+#define E7 1.9841269841269841e-4f
+#define E6 1.3888888888888889e-3f
+#define E5 8.3333333333333333e-3f
+#define E4 4.1666666666666667e-2f
+#define E3 1.6666666666666667e-1f
+#define E2 0.5f
+/* below this value exp(x) - 1 is accurate */
+#define EXPM1_LO -0.5f
+
+__attribute__((target("avx2,fma")))
+static inline __m256 expm1256_ps(__m256 x)
+{
+    __m256 p, e;
+    /* polynomial for small |x|: x + x^2 * (1/2! + x * (1/3! + ...)) */
+    p = _mm256_set1_ps(E8);
+    p = _mm256_fmadd_ps(p, x, _mm256_set1_ps(E7));
+    p = _mm256_fmadd_ps(p, x, _mm256_set1_ps(E6));
+    p = _mm256_fmadd_ps(p, x, _mm256_set1_ps(E5));
+    p = _mm256_fmadd_ps(p, x, _mm256_set1_ps(E4));
+    p = _mm256_fmadd_ps(p, x, _mm256_set1_ps(E3));
+    p = _mm256_fmadd_ps(p, x, _mm256_set1_ps(E2));
+    p = _mm256_fmadd_ps(p, _mm256_mul_ps(x, x), x);
+    /* exp(x) - 1 for larger |x| */
+    e = _mm256_sub_ps(exp256_ps(x), _mm256_set1_ps(1.f));
+    return _mm256_blendv_ps(e, p, _mm256_and_ps(
+        _mm256_cmp_ps(x, _mm256_set1_ps(EXPM1_LO), _CMP_GT_OQ),
+        _mm256_cmp_ps(x, _mm256_set1_ps(-EXPM1_LO), _CMP_LT_OQ)));
+}
+
+__attribute__((target("avx2,fma")))
+static inline __m256 sigmoid256_ps(__m256 x)
+{
+    __m256 one = _mm256_set1_ps(1.f);
+    __m256 e = exp256_ps(_mm256_sub_ps(_mm256_setzero_ps(), x));
+    return _mm256_div_ps(one, _mm256_add_ps(one, e));
+}
+
+__attribute__((target("avx2,fma")))
+static inline __m256 elu256_ps(__m256 x)
+{
+    __m256 zero = _mm256_setzero_ps();
+    __m256 e = expm1256_ps(_mm256_min_ps(x, zero));
+    /* Note: NaNs are passed through, since the comparison is false */
+    return _mm256_blendv_ps(x, e, _mm256_cmp_ps(x, zero, _CMP_LT_OQ));
+}
+
+/* apply FN to blocks of 8 values, the remaining values via a buffer */
+#define APPLY_AVX2(FN, x, out, n)                                           \
+    do {                                                                    \
+        size_t i;                                                           \
+        float buf[8];                                                       \
+        for (i = 0; i + 8 <= n; i += 8)                                     \
+            _mm256_storeu_ps(out + i, FN(_mm256_loadu_ps(x + i)));          \
+        if (i < n) {                                                        \
+            memset(buf, 0, sizeof(buf));                                    \
+            memcpy(buf, x + i, (n - i) * sizeof(float));                    \
+            _mm256_storeu_ps(buf, FN(_mm256_loadu_ps(buf)));                \
+            memcpy(out + i, buf, (n - i) * sizeof(float));                  \
+        }                                                                   \
+    } while (0)
+
+__attribute__((target("avx2,fma")))
+static void vec_expf_avx2(const float *x, float *out, size_t n)
+{
+    APPLY_AVX2(exp256_ps, x, out, n);
+}
+
+__attribute__((target("avx2,fma")))
+static void vec_sigmoidf_avx2(const float *x, float *out, size_t n)
+{
+    APPLY_AVX2(sigmoid256_ps, x, out, n);
+}
+
+__attribute__((target("avx2,fma")))
+static void vec_eluf_avx2(const float *x, float *out, size_t n)
+{
+    APPLY_AVX2(elu256_ps, x, out, n);
+}
+
+static int have_avx2(void)
+{
+    return __builtin_cpu_supports("avx2") && __builtin_cpu_supports("fma");
+}
+
+#endif
+
+void vec_expf(const float *x, float *out, size_t n)
+{
+    size_t i;
+#ifdef HAVE_AVX2_KERNEL
+    if (have_avx2()) {
+        vec_expf_avx2(x, out, n);
+        return;
+    }
+#endif
+    for (i = 0; i < n; i++)
+        out[i] = expf(x[i]);
+}
+
+void vec_sigmoidf(const float *x, float *out, size_t n)
+{
+    size_t i;
+#ifdef HAVE_AVX2_KERNEL
+    if (have_avx2()) {
+        vec_sigmoidf_avx2(x, out, n);
+        return;
+    }
+#endif
+    for (i = 0; i < n; i++)
+        out[i] = 1.f / (1.f + expf(-x[i]));
+}
+
+void vec_eluf(const float *x, float *out, size_t n)
+{
+    size_t i;
+#ifdef HAVE_AVX2_KERNEL
+    if (have_avx2()) {
+        vec_eluf_avx2(x, out, n);
+        return;
+    }
+#endif
+    for (i = 0; i < n; i++)
+        out[i] = x[i] < 0 ? expm1f(x[i]) : x[i];
+}
@@ -0,0 +1,20 @@
+/*
+ * Vectorised single precision exponential function (and the activation
+ * functions based on it) for the ml.nn module.
+ */
+
+#ifndef MADMOM_VEC_EXP_H
+#define MADMOM_VEC_EXP_H
+
+#include <stddef.h>
+
+/* Exponential function, out[i] = exp(x[i]); x and out may be the same. */
+void vec_expf(const float *x, float *out, size_t n);
+
+/* Logistic sigmoid, out[i] = 1 / (1 + exp(-x[i])). */
+void vec_sigmoidf(const float *x, float *out, size_t n);
+
+/* Exponential linear unit, out[i] = x[i] < 0 ? expm1(x[i]) : x[i]. */
+void vec_eluf(const float *x, float *out, size_t n);
+
+#endif
@@ -10,6 +10,34 @@ from __future__ import absolute_import, division, print_function
 
 import numpy as np
 
+try:
+    from . import activations_impl as _impl
+except ImportError:
+    _impl = None
+
+# minimum number of elements for the compiled element-wise functions; for
+# smaller arrays (e.g. the gates of recurrent layers, which are called once
+# per frame) the overhead of dispatching outweighs the faster computation
+MIN_IMPL_SIZE = 512
+
+
+def _use_impl(x, out, min_size=0):
+    """
+    Determine whether the compiled activation functions can be used.
+
+    These require C-contiguous float32 or float64 arrays (with at least
+    `min_size` elements); if given, the output array must be of the same
+    shape and dtype.
+
+    """
+    if _impl is None or not isinstance(x, np.ndarray) or x.size < min_size:
+        return False
+    if x.dtype not in (np.float32, np.float64) or not x.flags.c_contiguous:
+        return False
+    return out is None or (isinstance(out, np.ndarray) and
+                           out.dtype == x.dtype and out.shape == x.shape and
+                           out.flags.c_contiguous)
+
 
 def linear(x, out=None):
     """
@@ -30,7 +58,9 @@ def linear(x, out=None):
     """
     if out is None or x is out:
         return x
-    out[:] = x
+    # Note: assigning to the Ellipsis does not create an intermediate view
+    #       (as slicing does), thus has less overhead than `out[:] = x`
+    out[...] = x
     return out
 
 
@@ -82,6 +112,11 @@ def sigmoid(x, out=None):
     # Note: define a wrapper around _sigmoid so we just have the dependency on
     #       madmom when pickling objects, not on scipy.special which may
     #       contain the bug mentioned above
+    if _use_impl(x, out, MIN_IMPL_SIZE) and x.dtype == np.float32:
+        if out is None:
+            out = np.empty_like(x)
+        _impl.sigmoid_f32(x.reshape(-1), out.reshape(-1))
+        return out
     return _sigmoid(x, out)
 
 
@@ -127,13 +162,19 @@ def elu(x, out=None):
        Fast and Accurate Deep Network Learning by Exponential Linear Units
        (ELUs), http://arxiv.org/abs/1511.07289
     """
-    if out is None:
-        out = x.copy()
-    elif out is not x:
-        out[:] = x[:]
-    m = x < 0
-    out[m] = np.exp(x[m]) - 1
-    return out
+    if _use_impl(x, out, MIN_IMPL_SIZE) and x.dtype == np.float32:
+        if out is None:
+            out = np.empty_like(x)
+        _impl.elu_f32(x.reshape(-1), out.reshape(-1))
+        return out
+    # exp(x) - 1 >= x holds for all x, thus max(x, expm1(min(x, 0))) yields
+    # the ELU without masking (the temporary is needed if computed in-place)
+    if out is None or out is x:
+        tmp = np.minimum(x, 0)
+    else:
+        tmp = np.minimum(x, 0, out=out)
+    np.expm1(tmp, out=tmp)
+    return np.maximum(x, tmp, out=tmp if out is None else out)
 
 
 def softmax(x, out=None):
@@ -153,14 +194,23 @@ def softmax(x, out=None):
         Softmax of input data.
 
     """
+    # Note: the compiled version reads the data only once from memory, but
+    #       for many classes NumPy's vectorised exp and reductions are faster
+    if (_use_impl(x, out) and x.ndim == 2 and
+            x.shape[1] < (128 if x.dtype == np.float32 else 32)):
+        if out is None:
+            out = np.empty_like(x)
+        _impl.softmax(x, out)
+        return out
     # determine maximum (over classes)
     tmp = np.amax(x, axis=1, keepdims=True)
-    # exp of the input minus the max
-    if out is None:
-        out = np.exp(x - tmp)
-    else:
-        np.exp(x - tmp, out=out)
-    # normalize by the sum (reusing the tmp variable)
+    # exp of the input minus the max; subtract directly into the output and
+    # exponentiate in-place, so no temporary array for `x - tmp` is needed
+    out = np.subtract(x, tmp, out=out)
+    np.exp(out, out=out)
+    # normalize by the sum (reusing the tmp variable), multiply with the
+    # reciprocal since this is faster than dividing each element
     np.sum(out, axis=1, keepdims=True, out=tmp)
-    out /= tmp
+    np.reciprocal(tmp, out=tmp)
+    out *= tmp
     return out
@@ -0,0 +1,295 @@
+# encoding: utf-8
+# cython: embedsignature=True
+"""
+This module contains compiled neural network activation functions for the
+ml.nn module.
+
+The functions operate on C-contiguous float32 or float64 arrays, the ones
+with a `_f32` suffix only on flattened float32 arrays. For float32, the
+exponential function is vectorised (using AVX2 if supported by the CPU).
+Please use the functions in :mod:`madmom.ml.nn.activations`, which dispatch
+to this module if possible.
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+
+cimport cython
+from cython.parallel cimport prange
+from libc.math cimport exp, expf
+
+
+cdef extern from "_vec_exp.h":
+    void vec_expf(const float *x, float *out, size_t n) noexcept nogil
+    void vec_sigmoidf(const float *x, float *out, size_t n) noexcept nogil
+    void vec_eluf(const float *x, float *out, size_t n) noexcept nogil
+
+
+ctypedef fused real_t:
+    float
+    double
+
+# number of elements processed at once by softmax (data stays in cache)
+cdef enum:
+    BLOCK_SIZE = 1024
+
+# minimum number of elements to compute the softmax in parallel (for smaller
+# inputs the overhead of starting threads outweighs the gain)
+cdef enum:
+    PARALLEL_SIZE = 65536
+
+# OpenMP (at least GCC's libgomp) is not fork-safe: if the parent process
+# used a parallel region, a forked child hangs when entering one, thus
+# forked children (e.g. of multiprocessing pools) compute serially
+cdef bint _parallel = True
+
+
+def _disable_parallel():
+    global _parallel
+    _parallel = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_disable_parallel)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def exp_f32(const float[::1] x, float[::1] out):
+    """
+    Vectorised single precision exponential function.
+
+    Parameters
+    ----------
+    x : numpy array, shape (N,)
+        Input data.
+    out : numpy array, shape (N,)
+        Array to hold the output data.
+
+    """
+    if x.shape[0]:
+        with nogil:
+            vec_expf(&x[0], &out[0], x.shape[0])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def sigmoid_f32(const float[::1] x, float[::1] out):
+    """
+    Logistic sigmoid function.
+
+    Parameters
+    ----------
+    x : numpy array, shape (N,)
+        Input data.
+    out : numpy array, shape (N,)
+        Array to hold the output data.
+
+    """
+    if x.shape[0]:
+        with nogil:
+            vec_sigmoidf(&x[0], &out[0], x.shape[0])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def elu_f32(const float[::1] x, float[::1] out):
+    """
+    Exponential linear (unit) transfer function.
+
+    Parameters
+    ----------
+    x : numpy array, shape (N,)
+        Input data.
+    out : numpy array, shape (N,)
+        Array to hold the output data.
+
+    """
+    if x.shape[0]:
+        with nogil:
+            vec_eluf(&x[0], &out[0], x.shape[0])
+
+
+cdef inline real_t _exp(real_t x) noexcept nogil:
+    if real_t is float:
+        return expf(x)
+    else:
+        return exp(x)
+
+
+@cython.cdivision(True)
+cdef inline void _softmax_row(const real_t *x, real_t *out,
+                              Py_ssize_t k) noexcept nogil:
+    """Softmax of a single row of length `k`."""
+    cdef Py_ssize_t j
+    cdef real_t m, s
+    # Note: the row is processed in three sweeps, but stays in cache, thus
+    #       the input is read and the output written only once from memory
+    # determine maximum
+    m = x[0]
+    for j in range(1, k):
+        if x[j] > m:
+            m = x[j]
+    # exp of the input minus the max and its sum
+    s = 0
+    for j in range(k):
+        out[j] = _exp(x[j] - m)
+        s = s + out[j]
+    # normalize by the sum (multiply with the reciprocal, which is faster)
+    s = 1 / s
+    for j in range(k):
+        out[j] = out[j] * s
+
+
+@cython.cdivision(True)
+cdef inline void _softmax_rows_f32(const float *x, float *out, Py_ssize_t n,
+                                  Py_ssize_t k) noexcept nogil:
+    """Softmax of `n` consecutive rows of length `k`."""
+    cdef Py_ssize_t i, j
+    cdef float m, s
+    # subtract the maximum of each row
+    for i in range(n):
+        m = x[i * k]
+        for j in range(1, k):
+            if x[i * k + j] > m:
+                m = x[i * k + j]
+        for j in range(k):
+            out[i * k + j] = x[i * k + j] - m
+    # exp of all rows at once
+    vec_expf(out, out, n * k)
+    # normalize each row by its sum (multiply with the reciprocal)
+    for i in range(n):
+        s = 0
+        for j in range(k):
+            s = s + out[i * k + j]
+        s = 1 / s
+        for j in range(k):
+            out[i * k + j] = out[i * k + j] * s
+
+
+@cython.cdivision(True)
+cdef inline void _softmax2_row(const real_t *x, real_t *out) noexcept nogil:
+    """Softmax of a single row of length 2."""
+    # softmax(x0, x1) = (sigmoid(x0 - x1), sigmoid(x1 - x0)), no reduction
+    cdef real_t d = x[0] - x[1]
+    out[0] = 1 / (1 + _exp(-d))
+    out[1] = 1 / (1 + _exp(d))
+
+
+@cython.cdivision(True)
+cdef inline void _softmax3_row(const real_t *x, real_t *out) noexcept nogil:
+    """Softmax of a single row of length 3."""
+    cdef real_t m, e0, e1, e2, s
+    m = x[0]
+    if x[1] > m:
+        m = x[1]
+    if x[2] > m:
+        m = x[2]
+    e0 = _exp(x[0] - m)
+    e1 = _exp(x[1] - m)
+    e2 = _exp(x[2] - m)
+    s = 1 / (e0 + e1 + e2)
+    out[0] = e0 * s
+    out[1] = e1 * s
+    out[2] = e2 * s
+
+
+cdef inline void _softmax2_rows_f32(const float *x, float *out,
+                                   Py_ssize_t n) noexcept nogil:
+    """Softmax of `n` consecutive rows of length 2."""
+    cdef Py_ssize_t i
+    cdef float d
+    # compute the sigmoid of the differences of the two classes
+    for i in range(n):
+        d = x[2 * i] - x[2 * i + 1]
+        out[2 * i] = d
+        out[2 * i + 1] = -d
+    vec_sigmoidf(out, out, 2 * n)
+
+
+@cython.cdivision(True)
+cdef inline void _softmax3_rows_f32(const float *x, float *out,
+                                   Py_ssize_t n) noexcept nogil:
+    """Softmax of `n` consecutive rows of length 3."""
+    cdef Py_ssize_t i
+    cdef float m, s
+    # subtract the maximum of each row
+    for i in range(n):
+        m = x[3 * i]
+        if x[3 * i + 1] > m:
+            m = x[3 * i + 1]
+        if x[3 * i + 2] > m:
+            m = x[3 * i + 2]
+        out[3 * i] = x[3 * i] - m
+        out[3 * i + 1] = x[3 * i + 1] - m
+        out[3 * i + 2] = x[3 * i + 2] - m
+    # exp of all rows at once
+    vec_expf(out, out, 3 * n)
+    # normalize each row by its sum
+    for i in range(n):
+        s = 1 / (out[3 * i] + out[3 * i + 1] + out[3 * i + 2])
+        out[3 * i] = out[3 * i] * s
+        out[3 * i + 1] = out[3 * i + 1] * s
+        out[3 * i + 2] = out[3 * i + 2] * s
+
+
+cdef inline void _softmax_block(const real_t *x, real_t *out, Py_ssize_t n,
+                                Py_ssize_t k) noexcept nogil:
+    """Softmax of a block of `n` consecutive rows of length `k`."""
+    cdef Py_ssize_t i
+    # Note: the most common numbers of classes (2 and 3) have specialised,
+    #       unrolled kernels without the generic reductions
+    if real_t is float:
+        # use the vectorised exp for the whole block
+        if k == 2:
+            _softmax2_rows_f32(x, out, n)
+        elif k == 3:
+            _softmax3_rows_f32(x, out, n)
+        else:
+            _softmax_rows_f32(x, out, n, k)
+    else:
+        if k == 2:
+            for i in range(n):
+                _softmax2_row(x + i * k, out + i * k)
+        elif k == 3:
+            for i in range(n):
+                _softmax3_row(x + i * k, out + i * k)
+        else:
+            for i in range(n):
+                _softmax_row(x + i * k, out + i * k, k)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def softmax(const real_t[:, ::1] x, real_t[:, ::1] out):
+    """
+    Softmax transfer function.
+
+    Parameters
+    ----------
+    x : numpy array, shape (N, K)
+        Input data.
+    out : numpy array, shape (N, K)
+        Array to hold the output data.
+
+    """
+    cdef Py_ssize_t b, i, num_blocks, n = x.shape[0], k = x.shape[1]
+    cdef Py_ssize_t num_rows
+    if n == 0 or k == 0:
+        return
+    # process the rows in blocks which fit into the cache
+    num_rows = max(1, BLOCK_SIZE // k)
+    num_blocks = (n + num_rows - 1) // num_rows
+    if n * k < PARALLEL_SIZE or not _parallel:
+        with nogil:
+            for b in range(num_blocks):
+                i = b * num_rows
+                _softmax_block(&x[i, 0], &out[i, 0], min(num_rows, n - i), k)
+    else:
+        # rows are independent, thus process (contiguous ranges of) blocks in
+        # parallel; all blocks have the same size, so schedule them statically
+        for b in prange(num_blocks, nogil=True, schedule='static'):
+            i = b * num_rows
+            _softmax_block(&x[i, 0], &out[i, 0], min(num_rows, n - i), k)
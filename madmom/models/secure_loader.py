@@ -184,7 +184,8 @@ def load_manifest() -> dict:
     Returns
     -------
     dict
-        Dictionary mapping model paths to their expected SHA256 hashes.
+        Dictionary mapping model paths to their expected SHA256 hashes
+        (either directly or as entries with a 'sha256' key).
     """
     manifest_path = MODELS_DIR / 'model_manifest.json'
     if not manifest_path.exists():
@@ -242,6 +243,10 @@ def verify_model_integrity(filepath: Path, manifest: Optional[dict] = None) -> b
         return True
 
     expected_hash = manifest.get(rel_path_str)
+    if isinstance(expected_hash, dict):
+        # Entries may also hold the file size and modification time, which
+        # are used by scripts/regenerate_manifest.py to skip unchanged files
+        expected_hash = expected_hash.get('sha256')
     if expected_hash is None:
         warnings.warn(
             f"Model file {rel_path_str} not found in manifest.\n"
@@ -3,7 +3,12 @@
 Script to migrate pickled model files to NumPy 2.x compatible format.
 
 This re-saves all .pkl files in the models directory to update dtype definitions
-that use align=0/1 (integers) to use align=False/True (booleans).
+that use align=0/1 (integers) to use align=False/True (booleans), and to
+redirect references to NumPy modules which were moved in NumPy 2.x.
+
+The pickle streams are rewritten on the opcode level, thus the models do not
+need to be loaded (and the classes used do not need to be importable). Only if
+the stream has an unexpected structure, the model is loaded and re-saved.
 
 Usage (from the repository root, with venv activated):
     python scripts/migrate_models.py
@@ -12,9 +17,15 @@ This will eliminate the VisibleDeprecationWarning about dtype align parameter.
 """
 
 import io
+import mmap
+import os
 import pickle
+import pickletools
+import struct
 import sys
+import tempfile
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 # Add the parent directory to sys.path so madmom can be imported
@@ -43,13 +54,231 @@ class NumpyBackwardsCompatUnpickler(pickle.Unpickler):
         return super().find_class(module, name)
 
 
-def migrate_model(filepath):
-    """Load and re-save a single model file.
+# Pickle opcodes which need to be tracked to find module names and the
+# arguments of numpy.dtype calls (all others are handled generically)
+STRING_OPCODES = {'STRING', 'BINSTRING', 'SHORT_BINSTRING', 'UNICODE',
+                  'SHORT_BINUNICODE', 'BINUNICODE', 'BINUNICODE8'}
+INT_OPCODES = {'INT', 'BININT', 'BININT1', 'BININT2', 'LONG', 'LONG1',
+               'LONG4'}
+BOOL_OPCODES = {'NEWTRUE', 'NEWFALSE'}
+MEMO_PUT_OPCODES = {'PUT', 'BINPUT', 'LONG_BINPUT', 'MEMOIZE'}
+MEMO_GET_OPCODES = {'GET', 'BINGET', 'LONG_BINGET'}
+TUPLE_OPCODES = {'EMPTY_TUPLE', 'TUPLE1', 'TUPLE2', 'TUPLE3'}
+
+
+class UnexpectedPickleStructure(Exception):
+    """Raised if a pickle stream cannot be migrated by rewriting opcodes."""
+
+
+class _Value:
+    """Stack or memo value tracked while scanning a pickle stream."""
+
+    def __init__(self, kind, value=None, span=None):
+        self.kind = kind
+        self.value = value
+        # byte range of the opcode which pushed the value
+        self.span = span
+
+
+def _encode_unicode(value, opcode_name):
+    """Encode a string as pickle opcode (of the same family as the given one)."""
+    if opcode_name == 'UNICODE':
+        return b'V' + value.encode('raw-unicode-escape') + b'\n'
+    data = value.encode('utf-8')
+    if opcode_name == 'SHORT_BINUNICODE' and len(data) < 256:
+        return b'\x8c' + struct.pack('<B', len(data)) + data
+    if opcode_name in ('SHORT_BINUNICODE', 'BINUNICODE') and len(data) < 2 ** 32:
+        return b'X' + struct.pack('<I', len(data)) + data
+    return b'\x8d' + struct.pack('<Q', len(data)) + data
 
-    Returns True if successful, False if skipped due to missing dependencies.
+
+def _pop_operands(stack, opcode):
+    """Pop the operands of `opcode` from the stack (see pickletools.dis)."""
+    before = opcode.stack_before
+    num_pop = len(before)
+    if (pickletools.markobject in before or
+            (opcode.name == 'POP' and stack and stack[-1].kind == 'mark')):
+        # pop everything up to (and including) the topmost mark
+        while stack and stack[-1].kind != 'mark':
+            stack.pop()
+        if not stack:
+            raise UnexpectedPickleStructure("missing mark")
+        stack.pop()
+        num_pop = before.index(pickletools.markobject) \
+            if pickletools.markobject in before else 0
+    if num_pop > len(stack):
+        raise UnexpectedPickleStructure("stack underflow")
+    popped = stack[len(stack) - num_pop:]
+    del stack[len(stack) - num_pop:]
+    return popped
+
+
+def find_edits(f):
+    """Scan a pickle stream and determine the necessary byte edits.
+
+    Parameters
+    ----------
+    f : file handle
+        Pickle stream.
+
+    Returns
+    -------
+    list
+        Edits as (start, end, replacement) tuples, sorted by position.
+
+    Raises
+    ------
+    UnexpectedPickleStructure
+        If the stream cannot be migrated by rewriting opcodes.
     """
-    print(f"  Migrating: {filepath.name}...", end=" ", flush=True)
+    edits = []
+    frames = []
+    stack = []
+    memo = {}
+    protocol = 0
+
+    def handle(opcode, arg, start, end):
+        nonlocal protocol
+        name = opcode.name
+        if name == 'PROTO':
+            protocol = arg
+        elif name == 'FRAME':
+            # frame lengths become invalid if the data changes, but frames
+            # are optional, thus they are dropped when rewriting the stream
+            frames.append((start, end, b''))
+        elif name in MEMO_PUT_OPCODES:
+            if not stack:
+                raise UnexpectedPickleStructure("memo put on empty stack")
+            memo[len(memo) if name == 'MEMOIZE' else arg] = stack[-1]
+        elif name in MEMO_GET_OPCODES:
+            value = memo.get(arg, _Value('object'))
+            if value.kind == 'int':
+                # integers are not memoized by pickle, rewriting them here
+                # would change all references
+                value = _Value('object')
+            stack.append(value)
+        elif name == 'MARK':
+            stack.append(_Value('mark'))
+        elif name in STRING_OPCODES:
+            if arg in NUMPY_MODULE_REDIRECTS:
+                if name not in ('UNICODE', 'SHORT_BINUNICODE', 'BINUNICODE',
+                                'BINUNICODE8'):
+                    raise UnexpectedPickleStructure(f"module name {arg!r}")
+                arg = NUMPY_MODULE_REDIRECTS[arg]
+                edits.append((start, end, _encode_unicode(arg, name)))
+            stack.append(_Value('str', arg))
+        elif name in INT_OPCODES and isinstance(arg, int) and \
+                not isinstance(arg, bool):
+            stack.append(_Value('int', arg, (start, end)))
+        elif name in BOOL_OPCODES or (name == 'INT' and isinstance(arg, bool)):
+            stack.append(_Value('bool', arg))
+        elif name in ('GLOBAL', 'INST'):
+            module, cls = arg.split(' ', 1)
+            if module in NUMPY_MODULE_REDIRECTS:
+                if name == 'INST':
+                    raise UnexpectedPickleStructure(f"instance of {arg!r}")
+                module = NUMPY_MODULE_REDIRECTS[module]
+                edits.append((start, end, b'c' + module.encode('utf-8') +
+                              b'\n' + cls.encode('utf-8') + b'\n'))
+            if name == 'INST':
+                _pop_operands(stack, opcode)
+                stack.append(_Value('object'))
+            else:
+                stack.append(_Value('global', (module, cls)))
+        elif name == 'STACK_GLOBAL':
+            module, cls = _pop_operands(stack, opcode)
+            if module.kind != 'str' or cls.kind != 'str':
+                raise UnexpectedPickleStructure("non-string global name")
+            stack.append(_Value('global', (module.value, cls.value)))
+        elif name in TUPLE_OPCODES:
+            stack.append(_Value('tuple', _pop_operands(stack, opcode)))
+        elif name == 'TUPLE':
+            # the items of the tuple are all items above the topmost mark
+            items = []
+            while stack and stack[-1].kind != 'mark':
+                items.insert(0, stack.pop())
+            if not stack:
+                raise UnexpectedPickleStructure("missing mark")
+            stack.pop()
+            stack.append(_Value('tuple', items))
+        elif name == 'REDUCE':
+            func, args = _pop_operands(stack, opcode)
+            if func.kind == 'global' and func.value == ('numpy', 'dtype'):
+                if args.kind != 'tuple' or len(args.value) != 3 or \
+                        any(a.kind not in ('int', 'bool')
+                            for a in args.value[1:]):
+                    raise UnexpectedPickleStructure("numpy.dtype arguments")
+                # dtype(obj, align, copy): convert integer flags to booleans
+                for a in args.value[1:]:
+                    if a.kind == 'int':
+                        if a.value not in (0, 1):
+                            raise UnexpectedPickleStructure("dtype flag value")
+                        if protocol >= 2:
+                            new = pickle.NEWTRUE if a.value else pickle.NEWFALSE
+                        else:
+                            new = pickle.TRUE if a.value else pickle.FALSE
+                        edits.append((a.span[0], a.span[1], new))
+            stack.append(_Value('object'))
+        else:
+            _pop_operands(stack, opcode)
+            if pickletools.markobject in opcode.stack_after:
+                stack.append(_Value('mark'))
+            stack.extend(_Value('object') for item in opcode.stack_after
+                         if item is not pickletools.markobject)
+
+    try:
+        # an opcode ends where the next one starts
+        ops = pickletools.genops(f)
+        opcode, arg, start = next(ops)
+        for next_opcode, next_arg, next_start in ops:
+            handle(opcode, arg, start, next_start)
+            opcode, arg, start = next_opcode, next_arg, next_start
+        # the last opcode is STOP (without argument)
+        handle(opcode, arg, start, start + 1)
+    except (ValueError, EOFError, StopIteration) as e:
+        raise UnexpectedPickleStructure(str(e)) from e
+
+    if not edits:
+        return []
+    return sorted(edits + frames)
 
+
+def migrate_stream(filepath):
+    """Migrate a model file by rewriting the opcodes of the pickle stream.
+
+    Returns True if the file was modified, False if it is already up to date.
+
+    Raises UnexpectedPickleStructure if the stream cannot be rewritten.
+    """
+    with open(filepath, 'rb') as f:
+        edits = find_edits(f)
+    if not edits:
+        return False
+
+    # Copy the unchanged parts of the memory-mapped file and apply the edits,
+    # write to a temporary file first, which then replaces the original one
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, suffix='.tmp')
+    try:
+        with open(filepath, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                os.fdopen(fd, 'wb') as out:
+            data = memoryview(mm)
+            pos = 0
+            for start, end, replacement in edits:
+                out.write(data[pos:start])
+                out.write(replacement)
+                pos = end
+            out.write(data[pos:])
+            data.release()
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def migrate_by_reloading(filepath):
+    """Load and re-save a single model file."""
     # Load with latin1 encoding for Python 2 compatibility
     # Use custom unpickler to handle NumPy 2.x module changes
     with open(filepath, 'rb') as f:
@@ -58,12 +287,28 @@ def migrate_model(filepath):
             unpickler = NumpyBackwardsCompatUnpickler(f, encoding='latin1')
             obj = unpickler.load()
 
-    # Re-save with current pickle protocol
+    # Re-save with pickle protocol 5, which writes the data of contiguous
+    # arrays directly from their buffers (as in-band PickleBuffers) without
+    # copying them into the pickle stream. Out-of-band buffers are not used,
+    # since the models must remain loadable from a single file.
     with open(filepath, 'wb') as f:
-        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(obj, f, protocol=5)
 
-    print("done")
-    return True
+
+def migrate_model(filepath):
+    """Migrate a single model file.
+
+    Returns a short status message. Raises AttributeError if the model had to
+    be loaded, but uses classes which are not available.
+    """
+    try:
+        if migrate_stream(filepath):
+            return "done"
+        return "up to date"
+    except UnexpectedPickleStructure:
+        # Fall back to loading and re-saving the model
+        migrate_by_reloading(filepath)
+        return "done (reloaded)"
 
 
 def main():
@@ -84,9 +329,18 @@ def main():
 
     print(f"Found {len(pkl_files)} model files to migrate\n")
 
+    # Migrate the files in parallel, the results are reported (in order)
+    # once all files are processed
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {executor.submit(migrate_model, filepath): filepath
+                   for filepath in pkl_files}
+        results = {futures[future]: future for future in as_completed(futures)}
+
     # Track results
     migrated = 0
+    up_to_date = 0
     skipped = []
+    failed = False
 
     # Group by subdirectory for better output
     current_dir = None
@@ -96,18 +350,29 @@ def main():
             current_dir = parent
             print(f"\n{parent}/")
 
-        try:
-            if migrate_model(filepath):
+        print(f"  Migrating: {filepath.name}...", end=" ")
+        future = results[filepath]
+        e = future.exception()
+        if e is None:
+            status = future.result()
+            print(status)
+            if status == "up to date":
+                up_to_date += 1
+            else:
                 migrated += 1
-        except AttributeError as e:
+        elif isinstance(e, AttributeError):
             # Missing class/attribute - model uses unimplemented features
             print(f"SKIPPED (missing: {e})")
             skipped.append((filepath.relative_to(models_dir), str(e)))
-        except Exception as e:
+        else:
             print(f"FAILED: {e}")
-            return 1
+            failed = True
+
+    if failed:
+        return 1
 
     print(f"\n\nMigrated {migrated} model files")
+    print(f"{up_to_date} model files already up to date")
 
     if skipped:
         print(f"Skipped {len(skipped)} model files (missing layer implementations):")
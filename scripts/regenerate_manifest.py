@@ -3,28 +3,47 @@
 Regenerate the model manifest with updated SHA256 hashes.
 
 Usage (from the repository root):
-    python scripts/regenerate_manifest.py
+    python scripts/regenerate_manifest.py [--force]
 
 This updates madmom/models/model_manifest.json with fresh hashes
-for all .pkl model files.
+for all .pkl model files. Files whose size and modification time match
+the existing manifest entry are not rehashed, unless --force is given.
 """
 
+import argparse
 import hashlib
 import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from pathlib import Path
 
+# Files larger than this are read ahead sequentially when hashing
+LARGE_FILE_SIZE = 1 << 30
+
 
 def compute_file_hash(filepath: Path) -> str:
     """Compute SHA256 hash of a file."""
-    sha256 = hashlib.sha256()
     with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            sha256.update(chunk)
-    return sha256.hexdigest()
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            # empty files cannot be memory-mapped
+            return hashlib.sha256().hexdigest()
+        # Hash the memory-mapped file directly from the page cache, without
+        # copying it into an intermediate buffer
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if size > LARGE_FILE_SIZE and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            return hashlib.sha256(mm).hexdigest()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Regenerate the model manifest.")
+    parser.add_argument('--force', action='store_true',
+                        help="rehash all files, even if unchanged")
+    args = parser.parse_args()
+
     # Find the models directory
     script_dir = Path(__file__).parent
     models_dir = script_dir.parent / "madmom" / "models"
@@ -34,13 +53,16 @@ def main():
         print(f"Error: Models directory not found at {models_dir}")
         return 1
 
-    # Load existing manifest to preserve version info
+    # Load existing manifest to preserve version info and to reuse the
+    # hashes of unchanged files
     if manifest_path.exists():
         with open(manifest_path, 'r') as f:
             manifest = json.load(f)
         version = manifest.get('version', '0.17.0')
+        previous = manifest.get('models', {})
     else:
         version = '0.17.0'
+        previous = {}
 
     # Find all .pkl files and compute hashes
     pkl_files = sorted(models_dir.rglob("*.pkl"))
@@ -49,14 +71,37 @@ def main():
         print("No .pkl files found")
         return 0
 
-    print(f"Computing hashes for {len(pkl_files)} model files...\n")
-
+    # Determine which files changed (by size and modification time);
+    # entries without these (older manifests) are always rehashed
     models = {}
+    changed = []
     for filepath in pkl_files:
         rel_path = filepath.relative_to(models_dir)
         rel_path_str = str(rel_path).replace('\\', '/')  # Normalize for cross-platform
-        file_hash = compute_file_hash(filepath)
-        models[rel_path_str] = file_hash
+        st = filepath.stat()
+        prev = previous.get(rel_path_str)
+        models[rel_path_str] = {
+            "sha256": None,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        if (not args.force and isinstance(prev, dict) and
+                prev.get('size') == st.st_size and
+                prev.get('mtime_ns') == st.st_mtime_ns):
+            models[rel_path_str]["sha256"] = prev['sha256']
+        else:
+            changed.append((rel_path_str, filepath))
+
+    print(f"Computing hashes for {len(changed)} of {len(pkl_files)} model files...\n")
+
+    # Hash the files concurrently (hashlib releases the GIL while hashing);
+    # map() returns the hashes in the (sorted) order of the files
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        file_hashes = executor.map(compute_file_hash,
+                                   [filepath for _, filepath in changed])
+
+    for (rel_path_str, _), file_hash in zip(changed, file_hashes):
+        models[rel_path_str]["sha256"] = file_hash
         print(f"  {rel_path_str}: {file_hash[:16]}...")
 
     # Create new manifest
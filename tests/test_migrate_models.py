@@ -0,0 +1,156 @@
+# encoding: utf-8
+# pylint: skip-file
+"""
+This file contains tests for the scripts/migrate_models.py script.
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import importlib.util
+import io
+import os
+import pickle
+import pickletools
+import shutil
+import struct
+import tempfile
+import unittest
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+from . import BASE_PATH
+
+# load the script as module
+spec = importlib.util.spec_from_file_location(
+    'migrate_models',
+    os.path.join(BASE_PATH, '..', 'scripts', 'migrate_models.py'))
+migrate_models = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(migrate_models)
+
+
+def short_unicode(string):
+    # SHORT_BINUNICODE opcode
+    data = string.encode('utf-8')
+    return b'\x8c' + struct.pack('<B', len(data)) + data
+
+
+# numpy.dtype('f8', 0, 1) as written by Python 2 (protocol 0 and 2)
+DTYPE_P0 = b"cnumpy\ndtype\n(Vf8\nI0\nI1\ntR."
+DTYPE_P2 = b"\x80\x02cnumpy\ndtype\nX\x02\x00\x00\x00f8K\x00K\x01\x87R."
+# numpy.core.multiarray._reconstruct(numpy.ndarray, (0, ), b'b') via GLOBAL
+ARRAY_P2 = (b"\x80\x02cnumpy.core.multiarray\n_reconstruct\n"
+            b"cnumpy\nndarray\nK\x00\x85C\x01b\x87R.")
+# the same via STACK_GLOBAL, inside a frame
+ARRAY_P4_BODY = (short_unicode('numpy.core.multiarray') +
+                 short_unicode('_reconstruct') + b'\x93' +
+                 short_unicode('numpy') + short_unicode('ndarray') + b'\x93' +
+                 b'K\x00\x85C\x01b\x87R.')
+ARRAY_P4 = (b'\x80\x04\x95' + struct.pack('<Q', len(ARRAY_P4_BODY)) +
+            ARRAY_P4_BODY)
+# dtype flag which cannot be converted to a boolean
+DTYPE_INVALID = b"\x80\x02cnumpy\ndtype\nX\x02\x00\x00\x00f8K\x00K\x02\x87R."
+
+
+def migrate(data):
+    # apply the edits to the pickle stream
+    result = b''
+    pos = 0
+    for start, end, replacement in migrate_models.find_edits(
+            io.BytesIO(data)):
+        result += data[pos:start] + replacement
+        pos = end
+    return result + data[pos:]
+
+
+def opcodes(data):
+    return [(op.name, arg) for op, arg, _ in pickletools.genops(data)]
+
+
+def loads(data):
+    # load without any warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        return pickle.loads(data)
+
+
+class TestFindEditsFunction(unittest.TestCase):
+
+    def test_up_to_date(self):
+        for protocol in (0, 2, 4, 5):
+            for obj in (np.dtype('f8'), np.arange(3), [np.zeros(2)]):
+                data = pickle.dumps(obj, protocol=protocol)
+                self.assertEqual(
+                    migrate_models.find_edits(io.BytesIO(data)), [])
+
+    def test_dtype_flags(self):
+        # protocol 0 has no NEWFALSE/NEWTRUE opcodes
+        result = migrate(DTYPE_P0)
+        self.assertIn(('INT', False), opcodes(result))
+        self.assertIn(('INT', True), opcodes(result))
+        self.assertEqual(loads(result), np.dtype('f8'))
+        result = migrate(DTYPE_P2)
+        ops = [name for name, _ in opcodes(result)]
+        self.assertEqual(ops, ['PROTO', 'GLOBAL', 'BINUNICODE', 'NEWFALSE',
+                               'NEWTRUE', 'TUPLE3', 'REDUCE', 'STOP'])
+        self.assertEqual(loads(result), np.dtype('f8'))
+
+    def test_global_redirect(self):
+        result = migrate(ARRAY_P2)
+        self.assertIn(('GLOBAL', 'numpy._core.multiarray _reconstruct'),
+                      opcodes(result))
+        self.assertNotIn(b'numpy.core', result)
+        array = loads(result)
+        self.assertEqual(array.shape, (0, ))
+        self.assertEqual(array.dtype, np.int8)
+
+    def test_stack_global_redirect(self):
+        result = migrate(ARRAY_P4)
+        ops = opcodes(result)
+        # frame is dropped, since its length changed
+        self.assertNotIn('FRAME', [name for name, _ in ops])
+        self.assertIn(('SHORT_BINUNICODE', 'numpy._core.multiarray'), ops)
+        self.assertNotIn(b'numpy.core', result)
+        array = loads(result)
+        self.assertEqual(array.shape, (0, ))
+        self.assertEqual(array.dtype, np.int8)
+
+    def test_unexpected_structure(self):
+        with self.assertRaises(migrate_models.UnexpectedPickleStructure):
+            migrate_models.find_edits(io.BytesIO(DTYPE_INVALID))
+        with self.assertRaises(migrate_models.UnexpectedPickleStructure):
+            migrate_models.find_edits(io.BytesIO(b'\x80\x02K\x00'))
+
+
+class TestMigrateModelFunction(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, data):
+        filepath = Path(self.tmp_dir) / 'model.pkl'
+        filepath.write_bytes(data)
+        return filepath
+
+    def test_rewrite(self):
+        filepath = self.write(ARRAY_P4)
+        self.assertEqual(migrate_models.migrate_model(filepath), 'done')
+        self.assertEqual(filepath.read_bytes(), migrate(ARRAY_P4))
+        self.assertEqual(migrate_models.migrate_model(filepath),
+                         'up to date')
+        # no temporary files are left
+        self.assertEqual(os.listdir(self.tmp_dir), ['model.pkl'])
+
+    def test_fallback(self):
+        # unexpected structures are migrated by loading and re-saving
+        filepath = self.write(DTYPE_INVALID)
+        self.assertEqual(migrate_models.migrate_model(filepath),
+                         'done (reloaded)')
+        data = filepath.read_bytes()
+        self.assertEqual(opcodes(data)[0], ('PROTO', 5))
+        self.assertEqual(loads(data), np.dtype('f8'))
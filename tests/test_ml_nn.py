@@ -7,6 +7,10 @@ This file contains tests for the madmom.ml.nn module.
 
 from __future__ import absolute_import, division, print_function
 
+import multiprocessing as mp
+import os
+import subprocess
+import sys
 import unittest
 
 from madmom.models import *
@@ -586,3 +590,146 @@ class ConvolutionalLayerClassTest(unittest.TestCase):
         self.assertTrue(np.allclose(out1, ConvolutionalLayerClassTest.O1))
         out3 = self.layer3x3.activate(self.data)
         self.assertTrue(np.allclose(out3, ConvolutionalLayerClassTest.O3))
+
+
+class TestActivationsClass(unittest.TestCase):
+
+    IN = np.array([[0.5, -1., 2.],
+                   [-0.3, 0.2, 0.],
+                   [1000., 1001., 999.]], dtype=np.float32)
+
+    def test_softmax(self):
+        x = TestActivationsClass.IN
+        e = np.exp(x - np.max(x, axis=1, keepdims=True))
+        correct = e / np.sum(e, axis=1, keepdims=True)
+        result = activations.softmax(x)
+        self.assertTrue(np.allclose(result, correct))
+        self.assertTrue(np.allclose(np.sum(result, axis=1), 1))
+        # output array
+        out = np.empty_like(x)
+        result = activations.softmax(x, out)
+        self.assertTrue(result is out)
+        self.assertTrue(np.allclose(out, correct))
+        # in-place
+        x = x.copy()
+        activations.softmax(x, x)
+        self.assertTrue(np.allclose(x, correct))
+
+    def test_elu(self):
+        x = TestActivationsClass.IN
+        correct = np.where(x < 0, np.exp(np.minimum(x, 0)) - 1, x)
+        result = activations.elu(x)
+        self.assertTrue(result is not x)
+        self.assertTrue(np.allclose(result, correct))
+        out = np.empty_like(x)
+        result = activations.elu(x, out)
+        self.assertTrue(result is out)
+        self.assertTrue(np.allclose(out, correct))
+        x = x.copy()
+        activations.elu(x, x)
+        self.assertTrue(np.allclose(x, correct))
+
+    def test_softmax_dispatch(self):
+        # compiled (contiguous) and NumPy (non-contiguous, many classes)
+        # versions must yield the same results
+        for dtype in (np.float32, np.float64):
+            for num_classes in (2, 3, 64):
+                x = np.random.randn(1000, 2 * num_classes).astype(dtype)
+                result = activations.softmax(x[:, ::2])
+                self.assertTrue(np.allclose(
+                    activations.softmax(np.ascontiguousarray(x[:, ::2])),
+                    result))
+                self.assertEqual(result.dtype, dtype)
+
+    def test_softmax_parallel(self):
+        # large inputs are processed in parallel (in blocks of rows); the
+        # number of rows is not a multiple of the number of rows per block
+        for dtype in (np.float32, np.float64):
+            for num_classes in (2, 3, 7, 31):
+                x = np.random.randn(30001, 2 * num_classes).astype(dtype)
+                result = activations.softmax(np.ascontiguousarray(x[:, ::2]))
+                self.assertTrue(np.allclose(result,
+                                            activations.softmax(x[:, ::2])))
+
+    @unittest.skipIf('fork' not in mp.get_all_start_methods(),
+                     'fork not supported')
+    def test_softmax_parallel_fork(self):
+        # forked children must not hang after the parent computed the
+        # softmax in parallel (OpenMP is not fork-safe)
+        code = (
+            "import multiprocessing as mp\n"
+            "import numpy as np\n"
+            "from madmom.ml.nn import activations\n"
+            "x = np.random.randn(50000, 3).astype(np.float32)\n"
+            "def softmax_sum(_):\n"
+            "    return float(activations.softmax(x).sum())\n"
+            "if __name__ == '__main__':\n"
+            "    activations.softmax(x)\n"
+            "    with mp.get_context('fork').Pool(2) as pool:\n"
+            "        print(sum(pool.map(softmax_sum, range(2))))\n")
+        env = dict(os.environ, OMP_NUM_THREADS='4',
+                   PYTHONPATH=os.pathsep.join(sys.path))
+        result = subprocess.run([sys.executable, '-c', code], env=env,
+                                capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertTrue(np.isclose(float(result.stdout), 100000, rtol=1e-4))
+
+    def test_softmax_few_classes(self):
+        # specialised versions for 2 and 3 classes, incl. saturation
+        x = np.array([[0, 0, 0], [0, 100, -100], [-1000, 0, 1000]])
+        correct = [[1. / 3, 1. / 3, 1. / 3], [0, 1, 0], [0, 0, 1]]
+        for dtype in (np.float32, np.float64):
+            for num_classes in (2, 3):
+                data = x[:, :num_classes].astype(dtype)
+                result = activations.softmax(data)
+                self.assertTrue(np.allclose(result.sum(axis=1), 1))
+                if num_classes == 3:
+                    self.assertTrue(np.allclose(result, correct))
+                # in-place
+                activations.softmax(data, out=data)
+                self.assertTrue(np.allclose(data, result))
+
+    def test_sigmoid(self):
+        x = np.linspace(-100, 100, 10001)
+        correct = 1. / (1. + np.exp(-x))
+        for dtype in (np.float32, np.float64):
+            result = activations.sigmoid(x.astype(dtype))
+            self.assertEqual(result.dtype, dtype)
+            self.assertTrue(np.allclose(result, correct))
+        # special values (small arrays are not processed by compiled code)
+        x = np.array([np.nan, -np.inf, np.inf, 0], dtype=np.float32)
+        for num in (1, activations.MIN_IMPL_SIZE):
+            result = activations.sigmoid(np.tile(x, num))
+            self.assertTrue(np.allclose(result, np.tile([np.nan, 0, 1, 0.5],
+                                                        num),
+                                        equal_nan=True))
+
+    def test_elu_special_values(self):
+        x = np.array([np.nan, -np.inf, np.inf, 0, -1000, 1000],
+                     dtype=np.float32)
+        correct = [np.nan, -1, np.inf, 0, -1, 1000]
+        for num in (1, activations.MIN_IMPL_SIZE):
+            result = activations.elu(np.tile(x, num))
+            self.assertTrue(np.allclose(result, np.tile(correct, num),
+                                        equal_nan=True))
+
+    def test_elu_precision(self):
+        # expm1 must be accurate for small negative values
+        x = -np.logspace(-30, 1, 2 * activations.MIN_IMPL_SIZE)
+        x = x.astype(np.float32)
+        correct = np.expm1(x.astype(np.float64))
+        self.assertTrue(np.allclose(activations.elu(x), correct, rtol=1e-6,
+                                    atol=0))
+
+    def test_linear(self):
+        x = TestActivationsClass.IN
+        self.assertTrue(activations.linear(x) is x)
+        self.assertTrue(activations.linear(x, x) is x)
+        out = np.empty_like(x)
+        result = activations.linear(x, out)
+        self.assertTrue(result is out)
+        self.assertTrue(np.array_equal(out, x))
+        # data is cast to the dtype of the output array
+        out = np.empty(x.shape, dtype=np.float64)
+        activations.linear(x, out)
+        self.assertTrue(np.allclose(out, x))
@@ -8,13 +8,20 @@ using the madmom-modern library.
 import os
 import json
 import uuid
+import time
 import tempfile
+import threading
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 from flask import Flask, render_template, request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
 
 import numpy as np
+import orjson
 
 # Import madmom components
 import sys
@@ -30,12 +37,96 @@ app.config['UPLOAD_FOLDER'] = Path(__file__).parent / 'uploads'
 app.config['UPLOAD_FOLDER'].mkdir(exist_ok=True)
 app.config['SAMPLES_FOLDER'] = Path(__file__).parent.parent / 'samples'
 
-ALLOWED_EXTENSIONS = {'wav', 'mp3', 'flac', 'ogg', 'm4a', 'aac'}
+ALLOWED_EXTENSIONS = frozenset({'wav', 'mp3', 'flac', 'ogg', 'm4a', 'aac'})
+
+# Jobs which are not polled for this many seconds (e.g. the browser tab was
+# closed) are discarded
+JOB_TIMEOUT = 3600
+
+
+def create_executor():
+    """Create the pool of worker processes for audio processing."""
+    # Audio is processed in worker processes, so requests are not blocked
+    # while the neural networks and the DBN run. Workers are spawned (not
+    # forked) to not inherit the state of the (threaded) Flask server.
+    num_cpus = os.cpu_count() or 2
+    num_workers = max(1, num_cpus // 2)
+    # Limit the OpenMP threads of each worker (used by madmom's compiled
+    # code), otherwise the workers together oversubscribe the CPUs. The
+    # variable must be set before the workers are started, since OpenMP
+    # reads it when madmom is imported; a value set by the user is kept.
+    os.environ.setdefault('OMP_NUM_THREADS',
+                          str(max(1, num_cpus // num_workers)))
+    return ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+
+
+executor = create_executor()
+executor_lock = threading.Lock()
+
+# Submitted processing jobs (job ID -> (Future, time of the last access))
+jobs = {}
+jobs_lock = threading.Lock()
+
+
+def submit_job(fn, *args):
+    """
+    Submit a job to the worker processes.
+
+    If a worker process died (e.g. it was killed because it ran out of
+    memory), the pool is broken and cannot be used anymore; it is replaced
+    by a new one and the job is submitted again.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Future of the submitted job.
+    """
+    global executor
+    with executor_lock:
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = create_executor()
+            return executor.submit(fn, *args)
+
+
+def expire_jobs():
+    """Discard jobs which were not accessed for more than JOB_TIMEOUT seconds."""
+    now = time.monotonic()
+    with jobs_lock:
+        for job_id, (future, accessed) in list(jobs.items()):
+            if now - accessed > JOB_TIMEOUT:
+                future.cancel()
+                del jobs[job_id]
+
+
+def file_extension(filename):
+    """Return the (lower case) file extension without the dot."""
+    return os.path.splitext(filename)[1][1:].lower()
 
 
-def allowed_file(filename):
+def allowed_file(ext):
     """Check if file extension is allowed."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return ext in ALLOWED_EXTENSIONS
+
+
+@lru_cache(maxsize=1)
+def _beat_proc():
+    """Return the (cached) RNN beat processor."""
+    # Note: loading the neural networks is expensive, thus create the
+    #       processor only once per worker process; a worker processes only
+    #       a single job at a time, so the processor is never used concurrently
+    return RNNBeatProcessor()
+
+
+@lru_cache(maxsize=1)
+def _downbeat_proc():
+    """Return the (cached) RNN downbeat processor."""
+    return RNNDownBeatProcessor()
 
 
 def process_beats(filepath, fps=100, min_bpm=55, max_bpm=215, transition_lambda=100):
@@ -60,11 +151,8 @@ def process_beats(filepath, fps=100, min_bpm=55, max_bpm=215, transition_lambda=
     numpy.ndarray
         Array of beat times in seconds.
     """
-    # Create beat processor
-    beat_processor = RNNBeatProcessor()
-
     # Process audio to get activations
-    activations = beat_processor(filepath)
+    activations = _beat_proc()(filepath)
 
     # Create DBN beat tracker with parameters
     beat_tracker = DBNBeatTrackingProcessor(
@@ -103,16 +191,14 @@ def process_downbeats(filepath, fps=100, beats_per_bar=None, min_bpm=55, max_bpm
     Returns
     -------
     tuple
-        (beats, downbeats) - Arrays of beat and downbeat times.
+        (beats, downbeats, positions) - Arrays of beat and downbeat times and
+        the position of the beats inside the bar.
     """
     if beats_per_bar is None:
         beats_per_bar = [3, 4]
 
-    # Create downbeat processor
-    downbeat_processor = RNNDownBeatProcessor()
-
     # Process audio to get activations
-    activations = downbeat_processor(filepath)
+    activations = _downbeat_proc()(filepath)
 
     # Create DBN downbeat tracker with parameters
     downbeat_tracker = DBNDownBeatTrackingProcessor(
@@ -127,11 +213,90 @@ def process_downbeats(filepath, fps=100, beats_per_bar=None, min_bpm=55, max_bpm
     # Returns array of [time, beat_position] where beat_position 1 = downbeat
     results = downbeat_tracker(activations)
 
-    # Separate beats and downbeats
-    all_beats = results[:, 0].tolist()
-    downbeats = results[results[:, 1] == 1, 0].tolist()
+    # Separate beat times and positions (copies are C-contiguous, which is
+    # required by orjson) and downbeats
+    all_beats = np.ascontiguousarray(results[:, 0])
+    positions = results[:, 1].astype(np.int8)
+    downbeats = all_beats[positions == 1]
 
-    return all_beats, downbeats, results.tolist()
+    return all_beats, downbeats, positions
+
+
+def analyze_audio(filepath, mode, fps, beats_per_bar, min_bpm, max_bpm,
+                  transition_lambda):
+    """
+    Process audio file for beat/downbeat detection (run in a worker process).
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the audio file.
+    mode : str
+        'beats' or 'downbeats'.
+    fps : int
+        Frames per second for processing.
+    beats_per_bar : list
+        List of possible beats per bar (only used for downbeats).
+    min_bpm : float
+        Minimum BPM for beat tracking.
+    max_bpm : float
+        Maximum BPM for beat tracking.
+    transition_lambda : float
+        Lambda parameter for DBN transitions.
+
+    Returns
+    -------
+    dict
+        Processing results.
+    """
+    if mode == 'beats':
+        beats = process_beats(
+            filepath,
+            fps=fps,
+            min_bpm=min_bpm,
+            max_bpm=max_bpm,
+            transition_lambda=transition_lambda
+        )
+
+        return {
+            'success': True,
+            'mode': 'beats',
+            'beats': beats,
+            'downbeats': [],
+            # all beats have the same position
+            'positions': 1,
+            'num_beats': len(beats),
+            'estimated_bpm': estimate_bpm(beats) if len(beats) > 1 else 0
+        }
+
+    all_beats, downbeats, positions = process_downbeats(
+        filepath,
+        fps=fps,
+        beats_per_bar=beats_per_bar,
+        min_bpm=min_bpm,
+        max_bpm=max_bpm,
+        transition_lambda=transition_lambda
+    )
+
+    return {
+        'success': True,
+        'mode': 'downbeats',
+        'beats': all_beats,
+        'downbeats': downbeats,
+        'positions': positions,
+        'num_beats': len(all_beats),
+        'num_downbeats': len(downbeats),
+        'estimated_bpm': estimate_bpm(all_beats) if len(all_beats) > 1 else 0
+    }
+
+
+def _orjson_response(payload, status=200):
+    """Create a JSON response, serializing NumPy arrays natively."""
+    return app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
 
 
 @app.route('/')
@@ -151,15 +316,18 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
-    if not allowed_file(file.filename):
+    # Determine the extension only once
+    ext = file_extension(file.filename)
+
+    if not allowed_file(ext):
         return jsonify({'error': f'File type not allowed. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
 
     # Generate unique filename
-    ext = file.filename.rsplit('.', 1)[1].lower()
     unique_filename = f"{uuid.uuid4().hex}.{ext}"
     filepath = app.config['UPLOAD_FOLDER'] / unique_filename
 
-    file.save(filepath)
+    # Copy the upload in 1 MiB chunks (instead of the default 16 KiB)
+    file.save(filepath, buffer_size=1 << 20)
 
     return jsonify({
         'success': True,
@@ -203,7 +371,7 @@ def serve_sample(filename):
 
 @app.route('/process', methods=['POST'])
 def process_audio():
-    """Process audio file for beat/downbeat detection."""
+    """Start processing audio file for beat/downbeat detection."""
     data = request.get_json()
 
     if not data or 'filename' not in data:
@@ -235,60 +403,67 @@ def process_audio():
     elif isinstance(beats_per_bar, list):
         beats_per_bar = [int(x) for x in beats_per_bar]
 
+    expire_jobs()
+
+    # Submit the job, the client polls /status/<job_id> for the result
     try:
-        if mode == 'beats':
-            beats = process_beats(
-                str(filepath),
-                fps=fps,
-                min_bpm=min_bpm,
-                max_bpm=max_bpm,
-                transition_lambda=transition_lambda
-            )
-
-            result = {
-                'success': True,
-                'mode': 'beats',
-                'beats': beats.tolist(),
-                'downbeats': [],
-                'beat_data': [[b, 1] for b in beats.tolist()],
-                'num_beats': len(beats),
-                'estimated_bpm': estimate_bpm(beats) if len(beats) > 1 else 0
-            }
-        else:
-            all_beats, downbeats, beat_data = process_downbeats(
-                str(filepath),
-                fps=fps,
-                beats_per_bar=beats_per_bar,
-                min_bpm=min_bpm,
-                max_bpm=max_bpm,
-                transition_lambda=transition_lambda
-            )
-
-            result = {
-                'success': True,
-                'mode': 'downbeats',
-                'beats': all_beats,
-                'downbeats': downbeats,
-                'beat_data': beat_data,
-                'num_beats': len(all_beats),
-                'num_downbeats': len(downbeats),
-                'estimated_bpm': estimate_bpm(all_beats) if len(all_beats) > 1 else 0
-            }
-
-        return jsonify(result)
+        future = submit_job(
+            analyze_audio,
+            str(filepath),
+            mode,
+            fps,
+            beats_per_bar,
+            min_bpm,
+            max_bpm,
+            transition_lambda
+        )
+    except Exception as e:
+        return jsonify({'error': f'Processing could not be started: {e}'}), 500
 
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        jobs[job_id] = (future, time.monotonic())
+
+    return jsonify({'success': True, 'job_id': job_id}), 202
+
+
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    """Get the status (and the results, once finished) of a processing job."""
+    with jobs_lock:
+        if job_id not in jobs:
+            return jsonify({'error': 'Job not found'}), 404
+        future, _ = jobs[job_id]
+        if not future.done():
+            jobs[job_id] = (future, time.monotonic())
+            return jsonify({'status': 'processing'})
+        # results are delivered only once
+        del jobs[job_id]
+
+    try:
+        result = future.result()
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'status': 'failed', 'error': str(e)}), 500
+
+    result['status'] = 'done'
+    return _orjson_response(result)
 
 
 def estimate_bpm(beats):
     """Estimate BPM from beat times."""
     if len(beats) < 2:
         return 0
-    intervals = np.diff(beats)
-    median_interval = np.median(intervals)
+    beats = np.asarray(beats)
+    intervals = np.subtract(beats[1:], beats[:-1])
+    # median in linear time (partial sort instead of a full one)
+    n = len(intervals)
+    if n % 2:
+        median_interval = np.partition(intervals, n // 2)[n // 2]
+    else:
+        intervals = np.partition(intervals, (n // 2 - 1, n // 2))
+        median_interval = (intervals[n // 2 - 1] + intervals[n // 2]) / 2
     if median_interval > 0:
-        return round(60.0 / median_interval, 1)
+        return round(float(60.0 / median_interval), 1)
     return 0
 
 